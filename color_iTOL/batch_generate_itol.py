@@ -6,105 +6,263 @@ Usage:
     1. Ensure you have the required script `generate_itol_taxonomy_colors.py` in the same directory.
     2. Update the paths in the script as necessary.
     3. Run this script to process all `.treefile` files in the specified directory.
+
+Concurrency model: trees are processed by a persistent pool of worker
+processes that import the generator module and call it in-process — there
+are no child subprocesses to overlap, so one worker per core with results
+streamed back through imap_unordered is the whole story.
 """
 
+import argparse
+import atexit
+import importlib.util
+import io
+import multiprocessing
 import os
-import glob
-import subprocess
+import pickle
+import re
 import sys
+import tempfile
+import traceback
+from contextlib import redirect_stdout
+from functools import partial
+
+# Worker pool is created once and reused across successive batch calls, so
+# repeated invocations (e.g. from a directory watcher) don't pay the
+# fork/spawn cost of a fresh pool each time
+_POOL = None
+
+# Per-worker state: the imported generator module (set up once by
+# _init_worker) plus the parsed taxonomy and invariant generator options,
+# cached per batch. The batch parameters travel with each task rather than
+# through the pool initializer, so a reused pool picks up a fresh taxonomy
+# cache or changed settings instead of serving the first batch's state
+_GEN = None
+_TAXONOMY = None
+_TAXONOMY_PATH = None
+_ARGS = None
+
+def _init_worker(script_path, worker_counter):
+    """Import the generator once in each worker and pin it to a core."""
+    global _GEN
+
+    # Pin each worker to its own core so the kernel doesn't stack several
+    # workers on one CPU while leaving others idle (Linux-only; the worker id
+    # comes from a shared counter since initargs are the same for every worker)
+    if hasattr(os, "sched_setaffinity"):
+        with worker_counter.get_lock():
+            worker_id = worker_counter.value
+            worker_counter.value += 1
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cores[worker_id % len(cores)]})
+
+    _GEN = load_generator_module(script_path)
+
+def _refresh_worker_state(taxonomy_cache, output_dir, verbose):
+    """Load the batch's taxonomy pickle and options, reusing them across
+    tasks until the batch (identified by its cache path) changes."""
+    global _TAXONOMY, _TAXONOMY_PATH, _ARGS
+
+    if taxonomy_cache != _TAXONOMY_PATH:
+        with open(taxonomy_cache, "rb") as f:
+            _TAXONOMY = pickle.load(f)
+        _TAXONOMY_PATH = taxonomy_cache
+        _ARGS = None
+
+    if (_ARGS is None or _ARGS.output_dir != output_dir
+            or _ARGS.verbose != verbose):
+        # Mirrors the CLI options of the old subprocess invocation; every
+        # field is the same for all trees of a batch, so build it once
+        _ARGS = argparse.Namespace(
+            tree_list=True,  # batch-style {gene}_itol_*.txt output naming
+            output_dir=output_dir,
+            output=None,
+            level="phylum",
+            labels=True,
+            root_method="midpoint",
+            outgroup=None,
+            save_rooted=True,
+            verbose=verbose,
+        )
+
+def get_pool(script_path):
+    """Lazily create the persistent worker pool."""
+    global _POOL
+    if _POOL is None:
+        worker_counter = multiprocessing.Value('i', 0)
+        _POOL = multiprocessing.Pool(processes=os.cpu_count() or 1,
+                                     initializer=_init_worker,
+                                     initargs=(script_path, worker_counter))
+        atexit.register(_POOL.join)
+        atexit.register(_POOL.close)  # atexit runs in LIFO order: close, then join
+    return _POOL
+
+# Matches the gene prefix ahead of the batch naming patterns, trying
+# '_verification_' before '_filtered_' like the old substring checks did;
+# the last alternative is the plain first-token fallback
+_GENE_RE = re.compile(r'(?P<verification>.*?)_verification_'
+                      r'|(?P<filtered>.*?)_filtered_'
+                      r'|(?P<fallback>[^_]*)')
+
+def extract_gene_name(tree_file):
+    """Extract the gene name from a tree filename."""
+    m = _GENE_RE.match(os.path.basename(tree_file))
+    return m.group(m.lastgroup)
+
+def load_generator_module(script_path):
+    """Import the generator script as a module so its helpers can be reused."""
+    spec = importlib.util.spec_from_file_location("generate_itol_taxonomy_colors", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def process_tree(tree_file, taxonomy_cache, output_dir, verbose=False):
+    """Process one tree in-process through the imported generator module.
+
+    Calling the generator directly skips the fork/exec, interpreter
+    startup and module-import cost that shelling out paid per chunk.
+    Returns (gene_name, ok, rooted_file, error_message), where rooted_file
+    is the rooted-tree path the generator actually wrote (None if saving
+    failed or was skipped).
+    """
+    gene_name = extract_gene_name(tree_file)
+    _refresh_worker_state(taxonomy_cache, output_dir, verbose)
+
+    # Keep the generator's progress chatter off the shared stdout, but hold
+    # on to it so a failure can still be explained to the parent
+    captured = io.StringIO()
+    try:
+        if _ARGS.verbose:
+            ok, rooted_file = _GEN.process_single_tree(tree_file, _TAXONOMY, _ARGS)
+        else:
+            with redirect_stdout(captured):
+                ok, rooted_file = _GEN.process_single_tree(tree_file, _TAXONOMY, _ARGS)
+    except Exception:
+        return gene_name, False, None, captured.getvalue() + traceback.format_exc()
+
+    # Error text is only materialized on the failure path; the common
+    # success case returns an empty string and pays no formatting cost
+    return gene_name, ok, rooted_file, "" if ok else captured.getvalue()
 
 def main():
     # Configuration
     trees_dir = "BASE_DIR"  # /path/to/your/trees_directory
     taxonomy_file = "BASE_DIR" # /path/to/your/taxonomy_file.txt
     output_dir = "BASE_DIR" # /path/to/your/output_directory
-    
+    verbose = False  # Set to True to stream child output to the terminal
+
     # Script path - should be in the same directory as this batch script
     script_path = os.path.join(output_dir, "generate_itol_taxonomy_colors.py")
-    
-    # Check if required files exist
-    if not os.path.exists(script_path):
-        print(f"Error: Script not found at {script_path}")
-        sys.exit(1)
-    
-    if not os.path.exists(taxonomy_file):
-        print(f"Error: Taxonomy file not found at {taxonomy_file}")
-        sys.exit(1)
-    
-    if not os.path.exists(trees_dir):
+
+    # No existence pre-checks here: a missing script or taxonomy file is
+    # reported by the child itself (stat-ing them up front just duplicates
+    # work and opens a TOCTOU window), and a missing trees directory
+    # surfaces directly from the scandir below.
+
+    # Find all .treefile files; scandir avoids the extra stat per entry
+    # that glob pays on large (especially network-mounted) directories
+    try:
+        with os.scandir(trees_dir) as it:
+            tree_files = [entry.path for entry in it
+                          if entry.is_file() and entry.name.endswith(".treefile")]
+    except FileNotFoundError:
         print(f"Error: Trees directory not found at {trees_dir}")
         sys.exit(1)
-    
-    # Find all .treefile files
-    tree_files = glob.glob(os.path.join(trees_dir, "*.treefile"))
-    
+
     if not tree_files:
         print(f"No .treefile files found in {trees_dir}")
         sys.exit(1)
-    
+
     print(f"Found {len(tree_files)} tree files to process")
     print(f"Trees directory: {trees_dir}")
     print(f"Taxonomy file: {taxonomy_file}")
     print(f"Output directory: {output_dir}")
     print(f"Script: {script_path}")
     print()
-    
+
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
-    
-    success_count = 0
-    
+
+    # Skip trees whose colors file is already newer than both the tree and
+    # the taxonomy, so a rerun over unchanged inputs costs a stat per tree
+    # instead of a full regeneration
+    try:
+        tax_mtime = os.stat(taxonomy_file).st_mtime
+    except FileNotFoundError:
+        print(f"Error: Taxonomy file not found at {taxonomy_file}")
+        sys.exit(1)
+
+    pending = []
+    skipped_count = 0
     for tree_file in sorted(tree_files):  # Sort for consistent ordering
+        gene_name = extract_gene_name(tree_file)
+        output_file = os.path.join(output_dir, f"{gene_name}_itol_colors.txt")
         try:
-            # Extract gene name from filename
-            basename = os.path.basename(tree_file)
-            # Handle different naming patterns
-            if '_verification_' in basename:
-                gene_name = basename.split('_verification_')[0]
-            elif '_filtered_' in basename:
-                gene_name = basename.split('_filtered_')[0] 
-            else:
-                gene_name = basename.split('_')[0]  # fallback
-            
-            output_file = os.path.join(output_dir, f"{gene_name}_itol_colors.txt")
-            labels_file = os.path.join(output_dir, f"{gene_name}_itol_labels.txt")
-            
-            print(f"Processing {gene_name}...")
-            
-            # Run the script with all the options from your successful run
-            cmd = [
-                sys.executable, script_path,
-                tree_file,
-                taxonomy_file,
-                "-o", output_file,
-                "-l", "phylum",
-                "--labels",  # Generate labels file
-                "--save-rooted",  # Save rooted trees
-                "-v"  # Verbose output
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=output_dir)
-            
-            if result.returncode == 0:
-                print(f"  ✓ Generated {os.path.basename(output_file)}")
-                print(f"  ✓ Generated {os.path.basename(labels_file)}")
-                if "--save-rooted" in cmd:
-                    rooted_file = os.path.join(output_dir, f"{gene_name}_midpoint.treefile")
-                    if os.path.exists(rooted_file):
-                        print(f"  ✓ Generated {os.path.basename(rooted_file)}")
+            src_mtime = max(os.stat(tree_file).st_mtime, tax_mtime)
+            if os.stat(output_file).st_mtime >= src_mtime:
+                print(f"Skipping {gene_name} (output up to date)")
+                skipped_count += 1
+                continue
+        except FileNotFoundError:
+            pass  # no output yet - process the tree
+        pending.append(tree_file)
+
+    if not pending:
+        print(f"\nAll {skipped_count} outputs up to date, nothing to do")
+        return
+
+    # Parse the taxonomy once here and hand every child a pickle of the
+    # parsed map, instead of N children re-parsing the same TSV from scratch
+    try:
+        gen = load_generator_module(script_path)
+    except FileNotFoundError:
+        print(f"Error: Script not found at {script_path}")
+        sys.exit(1)
+
+    try:
+        taxonomy_map = gen.load_taxonomy(taxonomy_file)
+    except FileNotFoundError:
+        print(f"Error: Taxonomy file not found at {taxonomy_file}")
+        sys.exit(1)
+
+    fd, taxonomy_cache = tempfile.mkstemp(suffix=".pkl", prefix="itol_taxonomy_")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(taxonomy_map, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    success_count = 0
+
+    # Dispatch individual trees to the persistent pool; each worker imports
+    # the generator and loads the parsed taxonomy once, then processes its
+    # trees entirely in-process
+    worker = partial(process_tree, taxonomy_cache=taxonomy_cache,
+                     output_dir=output_dir, verbose=verbose)
+    pool = get_pool(script_path)
+
+    try:
+        for gene_name, ok, rooted_file, error in pool.imap_unordered(worker, pending, chunksize=4):
+            # Emit the whole per-tree block in one write: a single stdout
+            # syscall instead of several, and no interleaving between trees
+            lines = [f"Processing {gene_name}...\n"]
+            if ok:
+                lines.append(f"  ✓ Generated {gene_name}_itol_colors.txt\n")
+                lines.append(f"  ✓ Generated {gene_name}_itol_labels.txt\n")
+                # Report the rooted tree the generator says it wrote (None
+                # when saving failed), rather than stat-ing or guessing the
+                # filename here
+                if rooted_file:
+                    lines.append(f"  ✓ Generated {os.path.basename(rooted_file)}\n")
                 success_count += 1
             else:
-                print(f"  ✗ Failed processing {gene_name}:")
-                if result.stderr:
-                    print(f"    Error: {result.stderr.strip()}")
-                if result.stdout:
-                    print(f"    Output: {result.stdout.strip()}")
-                
-        except Exception as e:
-            print(f"  ✗ Error processing {os.path.basename(tree_file)}: {e}")
-    
-    print(f"\nCompleted: {success_count}/{len(tree_files)} files processed successfully")
-    
+                lines.append(f"  ✗ Failed processing {gene_name}:\n")
+                if error:
+                    lines.append(f"    Error: {error.strip()}\n")
+            sys.stdout.write("".join(lines))
+    finally:
+        os.unlink(taxonomy_cache)
+
+    print(f"\nCompleted: {success_count}/{len(pending)} files processed successfully"
+          + (f" ({skipped_count} up to date)" if skipped_count else ""))
+
     if success_count > 0:
         print(f"\nGenerated files are in: {output_dir}")
         print("Files generated for each gene:")
@@ -113,4 +271,4 @@ def main():
         print("  - {gene}_midpoint.treefile (rooted tree)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -5,6 +5,7 @@ This script identifies taxonomic groups and creates consistent range-based color
 
 Usage:
     python generate_itol_taxonomy_colors.py <tree_file> <taxonomy_file> -o <output_file> -l <taxonomic_level> [-v] [--labels]
+    python generate_itol_taxonomy_colors.py <taxonomy_file> --tree-list <list_file> --output-dir <dir> [options]
 
     - iTOL troubleshooting problem with the legend: even when specifying legend in vertical, it sometimes ignores it.
         - When the dataset is loaded, manually set legend to vertical in the iTOL interface.
@@ -14,6 +15,9 @@ Arguments:
     tree_file: Path to the Newick tree file.
     taxonomy_file: Path to the taxonomy TSV file.
     -o, --output: Output iTOL file path (default: auto-generated).
+    --tree-list: File listing one tree file per line; processes them all in a
+        single invocation (the taxonomy is parsed once). Replaces tree_file.
+    --output-dir: Directory for auto-generated output files in --tree-list mode (default: current directory).
     -l, --level: Taxonomic level for grouping (default: phylum). Options: superkingdom, phylum, class, order, family.
     -v, --verbose: Verbose output.
     --labels: Generate external text labels file.
@@ -26,14 +30,22 @@ Requires:
     - biopython
 """
 
+import numpy as np
 import pandas as pd
 import argparse
 import os
+import pickle
 import sys
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
+from contextlib import nullcontext
 from Bio import Phylo
 
+# Compiled once at import: these run for every taxonomy entry and every
+# unmatched leaf, so per-call re.compile cache lookups add up
+_GCF_RE = re.compile(r'^GCF_\d+\.\d+-')
+_WP_RE = re.compile(r'WP_\d+\.\d+')
+
 def apply_tree_rooting(tree, root_method='midpoint', outgroup=None, verbose=False):
     """
     Apply rooting to the tree to ensure consistent topology for monophyletic analysis.
@@ -126,94 +138,128 @@ def parse_tree_file(tree_file):
     """Parse a Newick tree file and extract all leaf names."""
     try:
         tree = Phylo.read(tree_file, "newick")
-        leaves = [terminal.name for terminal in tree.get_terminals()]
-        return set(leaves), tree
+        # Cache the terminal list on the tree so later stages reuse it
+        # instead of walking the tree again
+        tree._cached_terminals = tree.get_terminals()
+        return {terminal.name for terminal in tree._cached_terminals}, tree
     except Exception as e:
         print(f"Warning: Could not parse tree with BioPython: {e}")
         return set(), None
 
 def load_taxonomy(taxonomy_file):
-    """Load taxonomy file and create mapping from sequence ID to taxonomic info."""
-    df = pd.read_csv(taxonomy_file, sep='\t')
-    
-    taxonomy_map = {}
-    for _, row in df.iterrows():
-        taxonomy_map[row['full_id']] = {
-            'superkingdom': row['superkingdom'],
-            'phylum': row['phylum'],
-            'class': row['class'] if 'class' in row else None,
-            'order': row['order'] if 'order' in row else None,
-            'family': row['family'] if 'family' in row else None,
-            'genus': row['genus'] if 'genus' in row else None,
-            'species': row['species'] if 'species' in row else None
-        }
-    
-    return taxonomy_map
+    """Load the taxonomy file as a DataFrame indexed by full_id.
+
+    The seven rank columns are kept column-oriented (categorical dtype)
+    instead of being exploded into per-id dicts: rank values repeat
+    heavily, so categories cut memory several-fold and downstream
+    grouping stays vectorized.
+    """
+    ranks = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+    # The pyarrow engine parses large TSVs multithreaded and severalfold
+    # faster when installed; otherwise fall back to the C engine, reading
+    # only the columns we use
+    try:
+        df = pd.read_csv(taxonomy_file, sep='\t', engine='pyarrow')
+    except ImportError:
+        df = pd.read_csv(taxonomy_file, sep='\t',
+                         usecols=lambda c: c == 'full_id' or c in ranks)
+
+    # reindex materializes any absent rank columns so every entry has all seven
+    df = df.reindex(columns=['full_id'] + ranks).set_index('full_id')[ranks]
+
+    for rank in ranks:
+        df[rank] = df[rank].astype('category')
+
+    return df
+
+def build_taxonomy_indexes(taxonomy_df):
+    """Precompute normalized-key lookup tables for fuzzy leaf matching.
+
+    Returns two dicts mapping (a) GCF-prefix-stripped ids and (b) bare
+    WP accessions back to their full taxonomy ids.
+    """
+    # The taxonomy doesn't change between trees, so cache the indexes on the
+    # frame: a --tree-list run builds them once instead of once per tree
+    cached = taxonomy_df.attrs.get('_leaf_match_indexes')
+    if cached is not None:
+        return cached
+
+    clean_index = {}
+    wp_index = {}
+    for tax_id in taxonomy_df.index:
+        clean_index.setdefault(_GCF_RE.sub('', tax_id), tax_id)
+        wp = _WP_RE.search(tax_id)
+        if wp:
+            wp_index.setdefault(wp.group(), tax_id)
+
+    taxonomy_df.attrs['_leaf_match_indexes'] = (clean_index, wp_index)
+    return clean_index, wp_index
+
+def match_tree_leaves_to_taxonomy(tree_leaves, taxonomy_df):
+    """Match tree leaf names to taxonomy entries.
+
+    Returns a dict mapping each matched leaf name to its taxonomy row id
+    (full_id), plus the list of unmatched leaves.
+    """
+    # Hashed lookups replace the old O(leaves x entries) substring scan;
+    # each leaf now costs an exact probe plus at most two normalized probes
+    clean_index, wp_index = build_taxonomy_indexes(taxonomy_df)
+    known_ids = taxonomy_df.index
 
-def match_tree_leaves_to_taxonomy(tree_leaves, taxonomy_map):
-    """Match tree leaf names to taxonomy entries."""
     matched = {}
     unmatched = []
-    
+
     for leaf in tree_leaves:
         if not leaf or leaf.isdigit():
             continue
-            
+
         # Try exact match first
-        if leaf in taxonomy_map:
-            matched[leaf] = taxonomy_map[leaf]
+        if leaf in known_ids:
+            matched[leaf] = leaf
+            continue
+
+        # Try matching without GCF prefix and version numbers
+        tax_id = clean_index.get(_GCF_RE.sub('', leaf))
+
+        # Try matching just the WP identifier
+        if tax_id is None:
+            leaf_wp = _WP_RE.search(leaf)
+            if leaf_wp:
+                tax_id = wp_index.get(leaf_wp.group())
+
+        if tax_id is not None:
+            matched[leaf] = tax_id
         else:
-            # Try to find partial matches
-            found = False
-            for tax_id in taxonomy_map:
-                if leaf in tax_id or tax_id in leaf:
-                    matched[leaf] = taxonomy_map[tax_id]
-                    found = True
-                    break
-                
-                # Try matching without GCF prefix and version numbers
-                clean_tax_id = re.sub(r'^GCF_\d+\.\d+-', '', tax_id)
-                clean_leaf = re.sub(r'^GCF_\d+\.\d+-', '', leaf)
-                if clean_tax_id == clean_leaf:
-                    matched[leaf] = taxonomy_map[tax_id]
-                    found = True
-                    break
-                    
-                # Try matching just the WP identifier
-                tax_wp = re.search(r'WP_\d+\.\d+', tax_id)
-                leaf_wp = re.search(r'WP_\d+\.\d+', leaf)
-                if tax_wp and leaf_wp and tax_wp.group() == leaf_wp.group():
-                    matched[leaf] = taxonomy_map[tax_id]
-                    found = True
-                    break
-            
-            if not found:
-                unmatched.append(leaf)
-    
+            unmatched.append(leaf)
+
     return matched, unmatched
 
-def group_by_taxonomy(matched_taxonomy, level='phylum'):
+def group_by_taxonomy(matched_taxonomy, taxonomy_df, level='phylum'):
     """Group sequences by taxonomic level."""
-    groups = defaultdict(list)
-    
-    for seq_id, tax_info in matched_taxonomy.items():
-        if level == 'phylum':
-            superkingdom = tax_info.get('superkingdom', 'Unknown')
-            phylum = tax_info.get('phylum', 'Unknown')
-            
-            if superkingdom == 'Archaea':
-                tax_group = 'Archaea'
-            elif superkingdom == 'Bacteria':
-                tax_group = phylum if phylum and phylum != 'Unknown' else 'Unknown'
-            else:
-                tax_group = 'Unknown'
-        else:
-            tax_group = tax_info.get(level, 'Unknown')
-        
-        if tax_group and tax_group != 'Unknown':
-            groups[tax_group].append(seq_id)
-    
-    return groups
+    if not matched_taxonomy:
+        return {}
+
+    # Select the matched rows and re-key them by leaf name
+    tax_df = taxonomy_df.loc[list(matched_taxonomy.values())]
+    tax_df.index = pd.Index(matched_taxonomy.keys())
+
+    # Vectorized version of the old per-sequence branch: Archaea collapse
+    # into one group, Bacteria group by phylum, anything else is Unknown
+    if level == 'phylum':
+        phylum = tax_df['phylum'].astype(object).fillna('Unknown')
+        tax_group = np.where(tax_df['superkingdom'].eq('Archaea'), 'Archaea',
+                             np.where(tax_df['superkingdom'].eq('Bacteria'),
+                                      phylum, 'Unknown'))
+    else:
+        tax_group = tax_df[level].astype(object).fillna('Unknown').to_numpy()
+
+    # Unknown groups are dropped, as before; members are sets so the
+    # monophyly pass can use them for membership tests directly
+    return defaultdict(set,
+                       {name: set(members)
+                        for name, members in tax_df.index.to_series().groupby(tax_group)
+                        if name != 'Unknown'})
 
 def define_taxonomic_colors():
     """Define colors for different taxonomic groups - ordered by abundance in database."""
@@ -257,105 +303,146 @@ def define_taxonomic_colors():
     }
     return colors
 
-def find_monophyletic_clusters(tree, group_sequences, verbose=False):
+def build_clade_bitsets(tree, terminals):
+    """Index every terminal and build per-clade leaf bitsets in one post-order pass.
+
+    Each clade's descendant-leaf set is represented as a numpy uint64 bit
+    array (one bit per terminal), the standard bipartition encoding: the
+    "is this clade entirely inside a group" test then costs a few word-wide
+    AND/compare operations instead of a subtree traversal, and the bitsets
+    are built once per tree and shared by every taxonomic group.
     """
-    Find monophyletic clusters within a taxonomic group using proper BioPython methods.
-    Returns clusters of sequences that are monophyletic, plus isolated sequences.
+    leaf_index = {t.name: i for i, t in enumerate(terminals)}
+    n_words = (len(terminals) + 63) // 64 or 1
+
+    clade_bits = {}
+    for clade in tree.find_clades(order='postorder'):
+        bits = np.zeros(n_words, dtype=np.uint64)
+        if clade.is_terminal():
+            i = leaf_index[clade.name]
+            bits[i >> 6] = np.uint64(1) << np.uint64(i & 63)
+        else:
+            for child in clade.clades:
+                bits |= clade_bits[child]
+        clade_bits[clade] = bits
+
+    return leaf_index, clade_bits
+
+def find_monophyletic_clusters(tree, group_sequences, name_to_terminal=None,
+                               leaf_index=None, clade_bits=None, verbose=False):
+    """
+    Find monophyletic clusters within a taxonomic group using bitset bipartitions.
+    Returns clusters as numpy index arrays into the tree's terminal order
+    (one array per monophyletic cluster, isolated sequences as singletons);
+    without a tree the group comes back as a single list of names.
+
+    name_to_terminal, leaf_index and clade_bits are optional per-tree caches
+    computed once by the caller (see build_clade_bitsets), so each group
+    costs dict lookups and word-wide bit tests instead of tree walks.
     """
     if not group_sequences or not tree:
-        return [group_sequences] if group_sequences else []
-    
-    # Get terminals that belong to this group
-    group_terminals = []
-    group_terminal_names = set(group_sequences)
-    
-    for terminal in tree.get_terminals():
-        if terminal.name in group_terminal_names:
-            group_terminals.append(terminal)
-    
+        return [list(group_sequences)] if group_sequences else []
+
+    if name_to_terminal is None:
+        name_to_terminal = {t.name: t for t in tree.get_terminals()}
+
+    # Get terminals that belong to this group; the groups are already sets,
+    # so membership tests below use them as-is instead of rebuilding one
+    group_terminal_names = (group_sequences if isinstance(group_sequences, set)
+                            else set(group_sequences))
+    group_terminals = [name_to_terminal[name] for name in group_sequences
+                       if name in name_to_terminal]
+
+    if leaf_index is None or clade_bits is None:
+        leaf_index, clade_bits = build_clade_bitsets(tree, list(name_to_terminal.values()))
+
     if len(group_terminals) <= 1:
-        return [[terminal.name for terminal in group_terminals]]
-    
+        return [np.array([leaf_index[t.name] for t in group_terminals], dtype=np.intp)]
+
     if verbose:
         print(f"    Found {len(group_terminals)} terminals for this group")
-    
-    # First check if entire group is monophyletic
-    try:
-        if hasattr(tree, 'is_monophyletic') and tree.is_monophyletic(group_terminals):
-            if verbose:
-                print(f"    Entire group is monophyletic!")
-            return [[terminal.name for terminal in group_terminals]]
-    except:
-        pass
-    
-    # Find clusters by examining the tree structure
-    clusters = []
-    processed_terminals = set()
-    
-    # Use a recursive approach to find monophyletic clusters
-    def find_clusters_recursive(clade, current_cluster):
-        """Recursively traverse tree to find monophyletic clusters."""
-        if clade.is_terminal():
-            if clade.name in group_terminal_names:
-                current_cluster.append(clade)
-            return
-        
-        # Check children
-        group_children = []
-        non_group_children = []
-        
-        for child in clade:
-            child_terminals = child.get_terminals() if not child.is_terminal() else [child]
-            child_group_terminals = [t for t in child_terminals if t.name in group_terminal_names]
-            
-            if child_group_terminals:
-                if len(child_group_terminals) == len(child_terminals):
-                    # This child contains only our group sequences (monophyletic)
-                    group_children.append(child)
-                else:
-                    # This child contains mixed sequences, need to go deeper
-                    find_clusters_recursive(child, current_cluster)
-            else:
-                non_group_children.append(child)
-        
-        # If we have group-only children, they form monophyletic clusters
-        for group_child in group_children:
-            child_terminals = group_child.get_terminals()
-            cluster_names = [t.name for t in child_terminals if t.name in group_terminal_names]
-            if cluster_names:
-                clusters.append(cluster_names)
-                processed_terminals.update(child_terminals)
-    
-    try:
-        find_clusters_recursive(tree.root, [])
-        
-        # Add any remaining individual terminals
-        for terminal in group_terminals:
-            if terminal not in processed_terminals:
-                clusters.append([terminal.name])
-        
-        if verbose:
-            print(f"    Found {len(clusters)} clusters with sizes: {[len(cluster) for cluster in clusters]}")
-        
-    except Exception as e:
+
+    # Group membership as a bitset over the leaf index space
+    group_bits = np.zeros_like(clade_bits[tree.root])
+    for name in group_terminal_names:
+        i = leaf_index.get(name)
+        if i is not None:
+            group_bits[i >> 6] |= np.uint64(1) << np.uint64(i & 63)
+
+    # Fast path: a group covering every leaf in the tree is trivially one
+    # monophyletic cluster (common for single-phylum trees) - the old code
+    # paid a full is_monophyletic MRCA walk inside a try/except for this
+    root_bits = clade_bits[tree.root]
+    if np.array_equal(group_bits, root_bits):
         if verbose:
-            print(f"    Error in cluster detection: {e}, using fallback")
-        # Fallback: treat each sequence individually
-        clusters = [[terminal.name] for terminal in group_terminals]
-    
-    return clusters if clusters else [[terminal.name for terminal in group_terminals]]
+            print(f"    Entire group is monophyletic!")
+        return [np.arange(len(leaf_index), dtype=np.intp)]
+
+    # Pre-order walk emitting each maximal all-group clade as one cluster:
+    # a clade is entirely inside the group iff its bits are a subset of the
+    # group bits. Group terminals under mixed clades fall out as singletons.
+    clusters = []
+    stack = [tree.root]
+    while stack:
+        clade = stack.pop()
+        bits = clade_bits[clade]
+        overlap = bits & group_bits
+        if not overlap.any():
+            continue
+        if np.array_equal(overlap, bits):
+            clusters.append(np.array([leaf_index[t.name] for t in clade.get_terminals()],
+                                     dtype=np.intp))
+        else:
+            # Reversed so clusters are collected in left-to-right tree order
+            stack.extend(reversed(clade.clades))
+
+    if verbose:
+        if len(clusters) == 1 and len(clusters[0]) == len(group_terminals):
+            print(f"    Entire group is monophyletic!")
+        print(f"    Found {len(clusters)} clusters with sizes: {[len(cluster) for cluster in clusters]}")
+
+    if clusters:
+        return clusters
+    return [np.array([leaf_index[t.name] for t in group_terminals], dtype=np.intp)]
 
 def process_taxonomic_groups(groups, tree, verbose=False):
-    """Process each taxonomic group to find monophyletic clusters."""
+    """Process each taxonomic group to find monophyletic clusters.
+
+    Returns (clusters, names): cluster membership is stored as numpy index
+    arrays into the names array, so the output writers can emit rows with
+    array operations instead of per-sequence Python iteration.
+    """
     all_clusters = {}
-    
+
+    # Walk the tree once (or reuse the parse-time cache): the terminal
+    # lookup and the per-clade bitsets are shared by every group
+    name_to_terminal = {}
+    leaf_index = clade_bits = None
+    if tree:
+        terminals = getattr(tree, '_cached_terminals', None)
+        if terminals is None:
+            terminals = tree.get_terminals()
+        name_to_terminal = {t.name: t for t in terminals}
+        leaf_index, clade_bits = build_clade_bitsets(tree, terminals)
+        names = np.array([t.name for t in terminals])
+    else:
+        # No tree to index against: synthesize an order from the groups so
+        # the degenerate path still round-trips through index arrays
+        names = np.array(sorted({seq for sequences in groups.values() for seq in sequences}))
+        leaf_index = {name: i for i, name in enumerate(names)}
+
     for group_name, sequences in groups.items():
         if verbose:
             print(f"  Processing {group_name} with {len(sequences)} sequences")
-        
+
         # Find monophyletic clusters within this group
-        clusters = find_monophyletic_clusters(tree, sequences, verbose)
-        
+        clusters = find_monophyletic_clusters(tree, sequences, name_to_terminal,
+                                              leaf_index, clade_bits, verbose)
+        if not tree:
+            # Degenerate no-tree path hands back names - convert once here
+            clusters = [np.array([leaf_index[name] for name in cluster], dtype=np.intp)
+                        for cluster in clusters]
+
         # Store clusters with appropriate names
         if len(clusters) == 1:
             # Single monophyletic group
@@ -365,27 +452,50 @@ def process_taxonomic_groups(groups, tree, verbose=False):
             for i, cluster in enumerate(clusters, 1):
                 cluster_name = f"{group_name}_clade{i}" if len(cluster) > 1 else f"{group_name}_isolated{i}"
                 all_clusters[cluster_name] = cluster
-    
-    return all_clusters
 
-def generate_itol_file(clusters, colors, output_file, tree_name, rooting_info=None):
-    """Generate iTOL DATASET_RANGE file with individual sequence coloring and dynamic legend."""
-    
-    # Color mapping with HEX colors
-    color_mapping = {}
-    
-    # Get unique taxonomic groups actually present in the tree
-    unique_groups = set()
-    for cluster_name in clusters.keys():
-        base_name = cluster_name.split('_clade')[0].split('_isolated')[0]
-        unique_groups.add(base_name)
-    
-    # Create color mapping for each cluster and track which colors are used
+    return all_clusters, names
+
+def _base_name(cluster_name):
+    """Strip the synthesized _cladeN/_isolatedN suffix from a cluster name.
+
+    One scan with str.find instead of the two split chains (each of which
+    allocated an intermediate list and substring).
+    """
+    end = len(cluster_name)
+    i = cluster_name.find('_clade')
+    if 0 <= i < end:
+        end = i
+    j = cluster_name.find('_isolated')
+    if 0 <= j < end:
+        end = j
+    return cluster_name[:end]
+
+def generate_itol_file(clusters, names, colors, output_file, tree_name, rooting_info=None):
+    """Generate iTOL DATASET_RANGE file with individual sequence coloring and dynamic legend.
+
+    Pass '-' as output_file to stream the dataset to stdout (progress and
+    summary messages then go to stderr), so downstream consumers can read
+    it from a pipe without an intermediate file.
+    """
+    # Keep informational output out of the dataset when streaming to stdout
+    log = sys.stderr if output_file == '-' else sys.stdout
+
+    # Color mapping with HEX colors; unknown clusters default to the
+    # Unknown color without a per-lookup fallback argument
+    color_mapping = defaultdict(lambda: colors['Unknown'])
+
+    # One fused pass over the clusters builds the color mapping, the set of
+    # used colors, the memoized base names, and the per-group cluster counts
+    # (this also replaced an unused unique_groups set the old passes built)
+    base_names = {}
     used_colors = {}  # Maps display name to color
-    
+    group_counts = Counter()
+
     for cluster_name in clusters.keys():
-        base_name = cluster_name.split('_clade')[0].split('_isolated')[0]
-        
+        base_name = _base_name(cluster_name)
+        base_names[cluster_name] = base_name
+        group_counts[base_name] += 1
+
         if base_name in colors:
             # Use the defined color for known phyla
             color_mapping[cluster_name] = colors[base_name]
@@ -394,7 +504,7 @@ def generate_itol_file(clusters, colors, output_file, tree_name, rooting_info=No
             # Use "Other Phylum" color for unknown phyla
             color_mapping[cluster_name] = colors['Other Phylum']
             used_colors['Other Phylum'] = colors['Other Phylum']
-            print(f"Info: {base_name} grouped as 'Other Phylum' in legend")
+            print(f"Info: {base_name} grouped as 'Other Phylum' in legend", file=log)
     
     # Sort the used colors by the order they appear in the original colors dictionary
     # This preserves the abundance-based ordering for phyla that are actually present
@@ -417,105 +527,105 @@ def generate_itol_file(clusters, colors, output_file, tree_name, rooting_info=No
     legend_colors = [item[1] for item in legend_items]
     legend_labels = [item[0] for item in legend_items]
     
-    with open(output_file, 'w') as f:
-        f.write("DATASET_RANGE\n")
-        f.write("#Automatically generated iTOL file for taxonomic range coloring\n")
-        f.write(f"#Tree: {tree_name}\n")
-        f.write("#Generated by generate_itol_taxonomy_colors.py (DATASET_RANGE format)\n")
-        f.write("#Individual sequence coloring (each sequence colored separately)\n")
-        f.write("#Legend shows only taxonomic groups present in this tree\n")
-        f.write("#Rare phyla are grouped as 'Other Phylum'\n")
-        
-        if rooting_info:
-            f.write(f"#Rooting: {rooting_info}\n")
-        
-        f.write("\n")
-        
-        # Mandatory settings
-        f.write("SEPARATOR COMMA\n")
-        f.write("\n")
-        f.write("DATASET_LABEL,Taxonomic_Ranges\n")
-        f.write("COLOR,#ffff00\n")
-        f.write("\n")
-        
-        # Optional settings
-        f.write("RANGE_TYPE,box\n")
-        f.write("RANGE_COVER,label\n")  # Individual sequence coloring
-        f.write("UNROOTED_SMOOTH,simplify\n")
-        f.write("COVER_LABELS,1\n")     
-        f.write("COVER_DATASETS,0\n")
-        f.write("FIT_LABELS,0\n")
-        f.write("\n")
-        
-        # Legend settings - only show groups actually present in tree
-        if legend_colors:
-            f.write("LEGEND_TITLE,Taxonomy\n")
-            f.write("LEGEND_POSITION_X,100\n")
-            f.write("LEGEND_POSITION_Y,100\n")
-            f.write("LEGEND_HORIZONTAL,0\n")  # Vertical legend
-            
-            # All shapes are squares (1)
-            legend_shapes = ','.join(['1'] * len(legend_colors))
-            f.write(f"LEGEND_SHAPES,{legend_shapes}\n")
-            
-            # Colors
-            legend_color_str = ','.join(legend_colors)
-            f.write(f"LEGEND_COLORS,{legend_color_str}\n")
-            
-            # Labels
-            legend_label_str = ','.join(legend_labels)
-            f.write(f"LEGEND_LABELS,{legend_label_str}\n")
-            
-            # All shapes have scale 1
-            legend_scales = ','.join(['1'] * len(legend_colors))
-            f.write(f"LEGEND_SHAPE_SCALES,{legend_scales}\n")
-            
-        f.write("\n")
-        
-        # Data section
-        f.write("DATA\n")
-        
-        # Process each cluster - COLOR INDIVIDUAL SEQUENCES, NOT CLADES
-        total_sequences = 0
-        for cluster_name, sequence_list in clusters.items():
-            color = color_mapping.get(cluster_name, colors['Unknown'])
-            
-            # Color each sequence individually (seq,seq,color format)
-            for seq_id in sequence_list:
-                f.write(f"{seq_id},{seq_id},{color}\n")
-                total_sequences += 1
-        
-        f.write("\n# End of range data\n")
-    
+    # Build the whole file in memory and flush it with one writelines call:
+    # a single buffered write instead of a Python/libc crossing per row
+    lines = []
+    lines.append("DATASET_RANGE\n")
+    lines.append("#Automatically generated iTOL file for taxonomic range coloring\n")
+    lines.append(f"#Tree: {tree_name}\n")
+    lines.append("#Generated by generate_itol_taxonomy_colors.py (DATASET_RANGE format)\n")
+    lines.append("#Individual sequence coloring (each sequence colored separately)\n")
+    lines.append("#Legend shows only taxonomic groups present in this tree\n")
+    lines.append("#Rare phyla are grouped as 'Other Phylum'\n")
+
+    if rooting_info:
+        lines.append(f"#Rooting: {rooting_info}\n")
+
+    lines.append("\n")
+
+    # Mandatory settings
+    lines.append("SEPARATOR COMMA\n")
+    lines.append("\n")
+    lines.append("DATASET_LABEL,Taxonomic_Ranges\n")
+    lines.append("COLOR,#ffff00\n")
+    lines.append("\n")
+
+    # Optional settings
+    lines.append("RANGE_TYPE,box\n")
+    lines.append("RANGE_COVER,label\n")  # Individual sequence coloring
+    lines.append("UNROOTED_SMOOTH,simplify\n")
+    lines.append("COVER_LABELS,1\n")
+    lines.append("COVER_DATASETS,0\n")
+    lines.append("FIT_LABELS,0\n")
+    lines.append("\n")
+
+    # Legend settings - only show groups actually present in tree
+    if legend_colors:
+        lines.append("LEGEND_TITLE,Taxonomy\n")
+        lines.append("LEGEND_POSITION_X,100\n")
+        lines.append("LEGEND_POSITION_Y,100\n")
+        lines.append("LEGEND_HORIZONTAL,0\n")  # Vertical legend
+
+        # All shapes are squares (1)
+        lines.append(f"LEGEND_SHAPES,{','.join(['1'] * len(legend_colors))}\n")
+
+        # Colors
+        lines.append(f"LEGEND_COLORS,{','.join(legend_colors)}\n")
+
+        # Labels
+        lines.append(f"LEGEND_LABELS,{','.join(legend_labels)}\n")
+
+        # All shapes have scale 1
+        lines.append(f"LEGEND_SHAPE_SCALES,{','.join(['1'] * len(legend_colors))}\n")
+
+    lines.append("\n")
+
+    # Data section
+    lines.append("DATA\n")
+
+    # Process each cluster - COLOR INDIVIDUAL SEQUENCES, NOT CLADES
+    total_sequences = 0
+    for cluster_name, member_idx in clusters.items():
+        # One vectorized seq,seq,color row build per cluster: the member
+        # names come straight out of the shared names array and the color
+        # is formatted once (seq,seq,color format)
+        seqs = names[member_idx]
+        rows = np.char.add(np.char.add(seqs, ","),
+                           np.char.add(seqs, f",{color_mapping[cluster_name]}\n"))
+        lines.extend(rows.tolist())
+        total_sequences += len(member_idx)
+
+    lines.append("\n# End of range data\n")
+
+    with (nullcontext(sys.stdout) if output_file == '-' else open(output_file, 'w')) as f:
+        f.writelines(lines)
+
     # Enhanced summary
-    print(f"Generated DATASET_RANGE file with {total_sequences} individually colored sequences")
-    print(f"Legend contains {len(legend_items)} taxonomic groups actually present in tree:")
+    print(f"Generated DATASET_RANGE file with {total_sequences} individually colored sequences", file=log)
+    print(f"Legend contains {len(legend_items)} taxonomic groups actually present in tree:", file=log)
     for label, color in legend_items:
         if label == 'Other Phylum':
             # Count how many different phyla are grouped under "Other Phylum"
             other_phyla = []
-            for cluster_name in clusters.keys():
-                base_name = cluster_name.split('_clade')[0].split('_isolated')[0]
+            for base_name in base_names.values():
                 if base_name not in colors or base_name in ['Other Phylum', 'Unknown']:
                     if base_name not in ['Other Phylum', 'Unknown'] and base_name not in other_phyla:
                         other_phyla.append(base_name)
             if other_phyla:
-                print(f"  - {label}: {color} (includes: {', '.join(other_phyla)})")
+                print(f"  - {label}: {color} (includes: {', '.join(other_phyla)})", file=log)
             else:
-                print(f"  - {label}: {color}")
+                print(f"  - {label}: {color}", file=log)
         else:
-            count = sum(1 for cluster_name in clusters.keys() 
-                       if cluster_name.split('_clade')[0].split('_isolated')[0] == label)
-            print(f"  - {label}: {color} ({count} group{'s' if count != 1 else ''})")
+            count = group_counts[label]
+            print(f"  - {label}: {color} ({count} group{'s' if count != 1 else ''})", file=log)
 
-def generate_text_labels_file(clusters, colors, output_file, tree_name, rooting_info=None):
+def generate_text_labels_file(clusters, names, colors, output_file, tree_name, rooting_info=None):
     """Generate iTOL DATASET_TEXT file for external taxonomic labels with real phylum names."""
     
     # Color mapping - use actual colors but show real taxonomic names
-    color_mapping = {}
-    for cluster_name in clusters.keys():
-        base_name = cluster_name.split('_clade')[0].split('_isolated')[0]
-        
+    color_mapping = defaultdict(lambda: colors['Unknown'])
+    base_names = {cluster_name: _base_name(cluster_name) for cluster_name in clusters}
+    for cluster_name, base_name in base_names.items():
         if base_name in colors:
             # Use the defined color for known phyla
             color_mapping[cluster_name] = colors[base_name]
@@ -523,188 +633,260 @@ def generate_text_labels_file(clusters, colors, output_file, tree_name, rooting_
             # Use "Other Phylum" color but keep the real taxonomic name in the label
             color_mapping[cluster_name] = colors['Other Phylum']
     
+    # Assemble the file in memory and flush it with one writelines call,
+    # mirroring the colors writer
+    lines = []
+    lines.append("DATASET_TEXT\n")
+    lines.append("#External text labels for taxonomic groups\n")
+    lines.append("#Shows actual phylum names only (no cluster/isolated info)\n")
+    lines.append(f"#Tree: {tree_name}\n")
+    lines.append("#Generated by generate_itol_taxonomy_colors.py\n")
+    if rooting_info:
+        lines.append(f"#Rooting: {rooting_info}\n")
+    lines.append("\n")
+
+    lines.append("#=================================================================#\n")
+    lines.append("#                    MANDATORY SETTINGS                           #\n")
+    lines.append("#=================================================================#\n")
+    lines.append("SEPARATOR TAB\n\n")
+    lines.append("DATASET_LABEL\tTaxonomic Groups\n")
+    lines.append("COLOR\t#000000\n\n")
+
+    lines.append("#=================================================================#\n")
+    lines.append("#                    OPTIONAL SETTINGS                           #\n")
+    lines.append("#=================================================================#\n")
+    lines.append("MARGIN\t20\n")
+    lines.append("SHOW_INTERNAL\t0\n")
+    lines.append("LABEL_ROTATION\t0\n")
+    lines.append("ALIGN_TO_TREE\t0\n")
+    lines.append("SIZE_FACTOR\t1.3\n\n")
+
+    lines.append("#=================================================================#\n")
+    lines.append("#       Actual data follows after the \"DATA\" keyword              #\n")
+    lines.append("#=================================================================#\n")
+    lines.append("DATA\n")
+    lines.append("#ID\tlabel\tposition\tcolor\tstyle\tsize_factor\trotation\n\n")
+
+    # Add labels for each cluster with SIMPLE taxonomic names only; the
+    # position/size/rotation fields are constant, so rows are built with
+    # plain tab joins around precomputed pieces rather than f-strings
+    position = "\t-1\t"
+    tail = "\t1.3\t0\n"
+    for cluster_name, member_idx in clusters.items():
+        color = color_mapping[cluster_name]
+        representative = names[member_idx[0]]  # Use first sequence as representative
+
+        # Simple display label - just the phylum name
+        display_label = base_names[cluster_name]
+
+        # Use a different text style for "Other Phylum" colored groups to
+        # distinguish them: major phyla bold, grouped minor phyla italic
+        style = "bold" if display_label in colors else "italic"
+
+        lines.append(representative + "\t" + display_label + position
+                     + color + "\t" + style + tail)
+
     with open(output_file, 'w') as f:
-        f.write("DATASET_TEXT\n")
-        f.write("#External text labels for taxonomic groups\n")
-        f.write("#Shows actual phylum names only (no cluster/isolated info)\n")
-        f.write(f"#Tree: {tree_name}\n")
-        f.write("#Generated by generate_itol_taxonomy_colors.py\n")
-        if rooting_info:
-            f.write(f"#Rooting: {rooting_info}\n")
-        f.write("\n")
-        
-        f.write("#=================================================================#\n")
-        f.write("#                    MANDATORY SETTINGS                           #\n")
-        f.write("#=================================================================#\n")
-        f.write("SEPARATOR TAB\n\n")
-        f.write("DATASET_LABEL\tTaxonomic Groups\n")
-        f.write("COLOR\t#000000\n\n")
-        
-        f.write("#=================================================================#\n")
-        f.write("#                    OPTIONAL SETTINGS                           #\n")
-        f.write("#=================================================================#\n")
-        f.write("MARGIN\t20\n")
-        f.write("SHOW_INTERNAL\t0\n")
-        f.write("LABEL_ROTATION\t0\n")
-        f.write("ALIGN_TO_TREE\t0\n")
-        f.write("SIZE_FACTOR\t1.3\n\n")
-        
-        f.write("#=================================================================#\n")
-        f.write("#       Actual data follows after the \"DATA\" keyword              #\n")
-        f.write("#=================================================================#\n")
-        f.write("DATA\n")
-        f.write("#ID\tlabel\tposition\tcolor\tstyle\tsize_factor\trotation\n\n")
-        
-        # Add labels for each cluster with SIMPLE taxonomic names only
-        for cluster_name, sequence_list in clusters.items():
-            color = color_mapping.get(cluster_name, colors['Unknown'])
-            representative = sequence_list[0]  # Use first sequence as representative
-            
-            # Extract the real taxonomic name (base_name) from cluster_name
-            base_name = cluster_name.split('_clade')[0].split('_isolated')[0]
-            
-            # Simple display label - just the phylum name
-            display_label = base_name
-            
-            # Use a different text style for "Other Phylum" colored groups to distinguish them
-            if base_name in colors:
-                # Major phyla get bold style
-                style = "bold"
-            else:
-                # Minor phyla (colored as "Other Phylum") get italic style to show they're grouped
-                style = "italic"
-            
-            f.write(f"{representative}\t{display_label}\t-1\t{color}\t{style}\t1.3\t0\n")
+        f.writelines(lines)
+
+def extract_gene_name(basename):
+    """Extract the gene name from a tree filename, handling batch naming patterns."""
+    if '_verification_' in basename:
+        return basename.split('_verification_')[0]
+    if '_filtered_' in basename:
+        return basename.split('_filtered_')[0]
+    return basename.split('_')[0]  # fallback
+
+def process_single_tree(tree_file, taxonomy_df, args):
+    """Run the full coloring pipeline for one tree file.
+
+    Returns (ok, rooted_file): ok is True on success, and rooted_file is
+    the path actually written by save_rooted_tree (None when no rooted
+    tree was saved), so callers can report it without guessing the name.
+    """
+    if not os.path.exists(tree_file):
+        print(f"Error: Tree file {tree_file} not found")
+        return False, None
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate iTOL taxonomy coloring files with improved monophyly detection')
-    parser.add_argument('tree_file', help='Path to Newick tree file')
-    parser.add_argument('taxonomy_file', help='Path to taxonomy TSV file')
-    parser.add_argument('-o', '--output', help='Output iTOL file path (default: auto-generated)')
-    parser.add_argument('-l', '--level', default='phylum', 
-                       choices=['superkingdom', 'phylum', 'class', 'order', 'family'],
-                       help='Taxonomic level for grouping (default: phylum)')
-    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
-    parser.add_argument('--labels', action='store_true', 
-                       help='Generate external text labels file')
-    parser.add_argument('--root-method', default='midpoint',
-                       choices=['midpoint', 'outgroup', 'none'],
-                       help='Tree rooting method (default: midpoint)')
-    parser.add_argument('--outgroup', 
-                       help='Outgroup sequence name (required for --root-method outgroup)')
-    parser.add_argument('--save-rooted', action='store_true',
-                       help='Save the rooted tree to a new file for reference')
-    
-    args = parser.parse_args()
-    
-    # Validate arguments
-    if args.root_method == 'outgroup' and not args.outgroup:
-        parser.error("--outgroup is required when using --root-method outgroup")
-    
-    # Check files exist
-    if not os.path.exists(args.tree_file):
-        print(f"Error: Tree file {args.tree_file} not found")
-        sys.exit(1)
-    
-    if not os.path.exists(args.taxonomy_file):
-        print(f"Error: Taxonomy file {args.taxonomy_file} not found")
-        sys.exit(1)
-    
     # Generate output filename if not provided
-    if not args.output:
-        tree_basename = os.path.splitext(os.path.basename(args.tree_file))[0]
-        args.output = f"{tree_basename}_itol_colors.txt"
-    
-    labels_output = args.output.replace('_colors.txt', '_labels.txt')
-    
+    if args.tree_list:
+        gene_name = extract_gene_name(os.path.basename(tree_file))
+        output = os.path.join(args.output_dir, f"{gene_name}_itol_colors.txt")
+    elif args.output:
+        output = args.output
+    else:
+        tree_basename = os.path.splitext(os.path.basename(tree_file))[0]
+        output = f"{tree_basename}_itol_colors.txt"
+
+    labels_output = output.replace('_colors.txt', '_labels.txt')
+
+    # When streaming the dataset to stdout, progress goes to stderr
+    log = sys.stderr if output == '-' else sys.stdout
+
     if args.verbose:
-        print(f"Processing tree: {args.tree_file}")
-        print(f"Using taxonomy: {args.taxonomy_file}")
-        print(f"Grouping by: {args.level}")
-        print(f"Rooting method: {args.root_method}")
+        print(f"Processing tree: {tree_file}", file=log)
+        print(f"Grouping by: {args.level}", file=log)
+        print(f"Rooting method: {args.root_method}", file=log)
         if args.outgroup:
-            print(f"Outgroup: {args.outgroup}")
-        print(f"Output file: {args.output}")
+            print(f"Outgroup: {args.outgroup}", file=log)
+        print(f"Output file: {output}", file=log)
         if args.labels:
-            print(f"Labels file: {labels_output}")
+            print(f"Labels file: {labels_output}", file=log)
         if args.save_rooted:
-            print(f"Save rooted tree: Enabled")
-    
-    # Load data
-    tree_leaves, tree = parse_tree_file(args.tree_file)
-    taxonomy_map = load_taxonomy(args.taxonomy_file)
-    
+            print(f"Save rooted tree: Enabled", file=log)
+
+    # Load tree
+    tree_leaves, tree = parse_tree_file(tree_file)
+
     if args.verbose:
-        print(f"Found {len(tree_leaves)} leaves in tree")
-        print(f"Loaded {len(taxonomy_map)} taxonomy entries")
-    
+        print(f"Found {len(tree_leaves)} leaves in tree", file=log)
+
     # Apply rooting
     rooting_info = None
+    rooted_file = None
     if tree:
-        print(f"\nApplying tree rooting...")
+        print(f"\nApplying tree rooting...", file=log)
         tree = apply_tree_rooting(tree, args.root_method, args.outgroup, args.verbose)
-        
+
         if args.root_method == 'midpoint':
             rooting_info = "Midpoint rooting applied"
         elif args.root_method == 'outgroup':
             rooting_info = f"Outgroup rooting with {args.outgroup}"
         else:
             rooting_info = "No rooting applied"
-        
-        # Save rooted tree if requested
+
+        # Save rooted tree if requested (next to the colors file, so callers
+        # don't have to run us with a particular working directory)
         if args.save_rooted:
-            save_rooted_tree(tree, args.tree_file, args.root_method, ".", args.verbose)
-    
+            rooted_file = save_rooted_tree(tree, tree_file, args.root_method,
+                                           os.path.dirname(output) or ".", args.verbose)
+
     # Match sequences to taxonomy
-    matched_taxonomy, unmatched = match_tree_leaves_to_taxonomy(tree_leaves, taxonomy_map)
-    
+    matched_taxonomy, unmatched = match_tree_leaves_to_taxonomy(tree_leaves, taxonomy_df)
+
     if args.verbose:
-        print(f"Matched {len(matched_taxonomy)} sequences to taxonomy")
+        print(f"Matched {len(matched_taxonomy)} sequences to taxonomy", file=log)
         if unmatched:
-            print(f"Warning: {len(unmatched)} sequences could not be matched")
-    
+            print(f"Warning: {len(unmatched)} sequences could not be matched", file=log)
+
     # Group by taxonomy
-    groups = group_by_taxonomy(matched_taxonomy, args.level)
-    
+    groups = group_by_taxonomy(matched_taxonomy, taxonomy_df, args.level)
+
     if args.verbose:
-        print(f"\nTaxonomic groups found ({args.level}):")
+        print(f"\nTaxonomic groups found ({args.level}):", file=log)
         for group_name, sequences in groups.items():
-            print(f"  {group_name}: {len(sequences)} sequences")
-    
+            print(f"  {group_name}: {len(sequences)} sequences", file=log)
+
     # Find monophyletic clusters
-    print(f"\nIdentifying monophyletic clusters...")
-    clusters = process_taxonomic_groups(groups, tree, args.verbose)
-    
+    print(f"\nIdentifying monophyletic clusters...", file=log)
+    clusters, names = process_taxonomic_groups(groups, tree, args.verbose)
+
     # Define colors
     colors = define_taxonomic_colors()
-    
+
     # Generate iTOL file
-    tree_name = os.path.basename(args.tree_file)
-    generate_itol_file(clusters, colors, args.output, tree_name, rooting_info)
-    
-    print(f"iTOL file generated: {args.output}")
-    
+    tree_name = os.path.basename(tree_file)
+    generate_itol_file(clusters, names, colors, output, tree_name, rooting_info)
+
+    print(f"iTOL file generated: {output}", file=log)
+
     # Generate text labels file if requested
     if args.labels:
-        generate_text_labels_file(clusters, colors, labels_output, tree_name, rooting_info)
-        print(f"iTOL labels file generated: {labels_output}")
-    
+        generate_text_labels_file(clusters, names, colors, labels_output, tree_name, rooting_info)
+        print(f"iTOL labels file generated: {labels_output}", file=log)
+
     if args.verbose:
-        print("\nSummary:")
-        print(f"  Total sequences in tree: {len(tree_leaves)}")
-        print(f"  Sequences matched to taxonomy: {len(matched_taxonomy)}")
-        print(f"  Taxonomic groups: {len(groups)}")
-        print(f"  Monophyletic clusters found: {len(clusters)}")
-        print(f"  Tree rooting: {rooting_info}")
-        
+        print("\nSummary:", file=log)
+        print(f"  Total sequences in tree: {len(tree_leaves)}", file=log)
+        print(f"  Sequences matched to taxonomy: {len(matched_taxonomy)}", file=log)
+        print(f"  Taxonomic groups: {len(groups)}", file=log)
+        print(f"  Monophyletic clusters found: {len(clusters)}", file=log)
+        print(f"  Tree rooting: {rooting_info}", file=log)
+
         # Report cluster information
         monophyletic_clusters = [name for name, seqs in clusters.items() if len(seqs) > 1 and '_isolated' not in name]
         isolated_sequences = [name for name in clusters.keys() if '_isolated' in name]
-        
+
         if monophyletic_clusters:
-            print(f"  Monophyletic clusters: {len(monophyletic_clusters)}")
+            print(f"  Monophyletic clusters: {len(monophyletic_clusters)}", file=log)
         if isolated_sequences:
-            print(f"  Isolated sequences: {len(isolated_sequences)}")
+            print(f"  Isolated sequences: {len(isolated_sequences)}", file=log)
+
+    return True, rooted_file
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate iTOL taxonomy coloring files with improved monophyly detection')
+    parser.add_argument('tree_file', nargs='?', default=None, help='Path to Newick tree file')
+    parser.add_argument('taxonomy_file', help='Path to taxonomy TSV file')
+    parser.add_argument('-o', '--output', help='Output iTOL file path (default: auto-generated)')
+    parser.add_argument('--tree-list',
+                       help='File listing one tree file per line; all are processed in a single run')
+    parser.add_argument('--output-dir', default='.',
+                       help='Directory for auto-generated output files in --tree-list mode (default: current directory)')
+    parser.add_argument('--taxonomy-cache',
+                       help='Pickled taxonomy map from a previous parse; loaded instead of re-parsing the TSV')
+    parser.add_argument('-l', '--level', default='phylum', 
+                       choices=['superkingdom', 'phylum', 'class', 'order', 'family'],
+                       help='Taxonomic level for grouping (default: phylum)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('--labels', action='store_true', 
+                       help='Generate external text labels file')
+    parser.add_argument('--root-method', default='midpoint',
+                       choices=['midpoint', 'outgroup', 'none'],
+                       help='Tree rooting method (default: midpoint)')
+    parser.add_argument('--outgroup', 
+                       help='Outgroup sequence name (required for --root-method outgroup)')
+    parser.add_argument('--save-rooted', action='store_true',
+                       help='Save the rooted tree to a new file for reference')
+    
+    args = parser.parse_args()
+
+    # Validate arguments
+    if args.root_method == 'outgroup' and not args.outgroup:
+        parser.error("--outgroup is required when using --root-method outgroup")
+
+    if not args.tree_file and not args.tree_list:
+        parser.error("a tree_file or --tree-list is required")
+
+    if args.output == '-' and args.labels:
+        parser.error("--labels cannot be combined with -o - (both datasets would share stdout)")
+
+    if not os.path.exists(args.taxonomy_file):
+        print(f"Error: Taxonomy file {args.taxonomy_file} not found")
+        sys.exit(1)
+
+    # Collect the tree files to process
+    if args.tree_list:
+        with open(args.tree_list) as f:
+            tree_files = [line.strip() for line in f if line.strip()]
+        if not tree_files:
+            print(f"Error: No tree files listed in {args.tree_list}")
+            sys.exit(1)
+    else:
+        tree_files = [args.tree_file]
+
+    if args.verbose:
+        print(f"Using taxonomy: {args.taxonomy_file}")
+
+    # Parse the taxonomy once for all trees in this invocation, or reuse a
+    # pre-parsed pickle when the caller already did the work
+    if args.taxonomy_cache:
+        with open(args.taxonomy_cache, 'rb') as f:
+            taxonomy_df = pickle.load(f)
+    else:
+        taxonomy_df = load_taxonomy(args.taxonomy_file)
+
+    if args.verbose:
+        print(f"Loaded {len(taxonomy_df)} taxonomy entries")
+
+    all_ok = True
+    for tree_file in tree_files:
+        ok, _rooted_file = process_single_tree(tree_file, taxonomy_df, args)
+        if not ok:
+            all_ok = False
+
+    if not all_ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
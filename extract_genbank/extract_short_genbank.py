@@ -9,6 +9,7 @@ For each line in the input TSV:
 
 import sys
 import csv
+from collections import defaultdict
 from pathlib import Path
 from Bio import SeqIO
 
@@ -19,15 +20,20 @@ GENBANK_DIR = BASE_DIR / "path/to/genbank_files"
 OUTPUT_DIR = BASE_DIR / "path/to/short_genbanks"
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-def get_gene_feature_indices(features, gene_ids):
-    idxs = []
-    for i, feat in enumerate(features):
-        if feat.type == "CDS":
-            # Try both 'locus_tag' and 'protein_id' and 'gene'
-            for key in ("locus_tag", "protein_id", "gene"):
-                if key in feat.qualifiers and feat.qualifiers[key][0] in gene_ids:
-                    idxs.append(i)
-    return idxs
+def build_qualifier_index(cds_features):
+    """Map locus_tag/protein_id/gene qualifier values to feature indices in one pass.
+
+    Built once per record so each gene pair resolves with two dict lookups
+    instead of rescanning every CDS.
+    """
+    qual_to_idx = {}
+    for i, feat in enumerate(cds_features):
+        # Try both 'locus_tag' and 'protein_id' and 'gene'
+        for key in ("locus_tag", "protein_id", "gene"):
+            values = feat.qualifiers.get(key)
+            if values:
+                qual_to_idx.setdefault(values[0], i)
+    return qual_to_idx
 
 def extract_region(features, idx1, idx2, flank=2):
     start = max(0, min(idx1, idx2) - flank)
@@ -37,17 +43,26 @@ def extract_region(features, idx1, idx2, flank=2):
 def main():
     from Bio.SeqRecord import SeqRecord
     from Bio.SeqFeature import SeqFeature, FeatureLocation
+
+    # Group the gene pairs by accession so each GenBank file is parsed (and
+    # its qualifier index built) once, however many pairs point at it
+    pairs_by_acc = defaultdict(list)
     with open(TSV_PATH) as tsvfile:
         reader = csv.reader(tsvfile, delimiter='\t')
         for row in reader:
             gene1, gene2, acc = row
-            gbk_path = GENBANK_DIR / f"{acc}.gbff"
-            if not gbk_path.exists():
-                print(f"GenBank file not found: {gbk_path}", file=sys.stderr)
-                continue
-            for record in SeqIO.parse(str(gbk_path), "genbank"):
-                cds_features = [f for f in record.features if f.type == "CDS"]
-                idxs = get_gene_feature_indices(cds_features, {gene1, gene2})
+            pairs_by_acc[acc].append((gene1, gene2))
+
+    for acc, gene_pairs in pairs_by_acc.items():
+        gbk_path = GENBANK_DIR / f"{acc}.gbff"
+        if not gbk_path.exists():
+            print(f"GenBank file not found: {gbk_path}", file=sys.stderr)
+            continue
+        for record in SeqIO.parse(str(gbk_path), "genbank"):
+            cds_features = [f for f in record.features if f.type == "CDS"]
+            qual_to_idx = build_qualifier_index(cds_features)
+            for gene1, gene2 in gene_pairs:
+                idxs = [qual_to_idx[g] for g in (gene1, gene2) if g in qual_to_idx]
                 if len(idxs) < 2:
                     print(f"Could not find both genes {gene1}, {gene2} in {acc}", file=sys.stderr)
                     continue
@@ -59,22 +74,22 @@ def main():
                 region_end = max(region_ends)
                 # Extract subsequence
                 sub_seq = record.seq[region_start:region_end]
-                # Adjust features to new coordinates
-                new_features = []
-                for f in region_features:
-                    # Shift feature location
-                    loc = f.location
-                    new_loc = FeatureLocation(
-                        int(loc.start) - region_start,
-                        int(loc.end) - region_start,
-                        strand=loc.strand
-                    )
-                    new_feat = SeqFeature(
-                        location=new_loc,
+                # Adjust features to new coordinates: a constant shift of
+                # each location, built in one comprehension with the
+                # location descriptor read once per feature (qualifier
+                # dicts stay shared by reference, as before)
+                new_features = [
+                    SeqFeature(
+                        location=FeatureLocation(
+                            int((loc := f.location).start) - region_start,
+                            int(loc.end) - region_start,
+                            strand=loc.strand
+                        ),
                         type=f.type,
                         qualifiers=f.qualifiers
                     )
-                    new_features.append(new_feat)
+                    for f in region_features
+                ]
                 # Copy record and update
                 new_record = SeqRecord(
                     sub_seq,
@@ -85,10 +100,12 @@ def main():
                     annotations=record.annotations
                 )
                 new_record.features = new_features
-                # Write to file
+                # Write through an open handle instead of the path form of
+                # SeqIO.write, which reopens and flushes per call
                 out_name = f"{acc}_short_{gene1}_{gene2}.gbk"
                 out_path = OUTPUT_DIR / out_name
-                SeqIO.write(new_record, str(out_path), "genbank")
+                with open(out_path, "w") as out_handle:
+                    SeqIO.write(new_record, out_handle, "genbank")
                 print(f"Wrote {out_path}")
 
 if __name__ == "__main__":
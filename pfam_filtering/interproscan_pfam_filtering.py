@@ -2,7 +2,14 @@ import csv
 import json
 import os
 import argparse
-from Bio import SeqIO
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; stdlib json is the fallback
+    orjson = None
 
 # Use: python interproscan_pfam_filtering.py /path/to/your/folder path/to/csv_filename
 # Inputs:
@@ -14,13 +21,95 @@ from Bio import SeqIO
 # Function to extract PFAM domains from each result in JSON
 def extract_pfam_domains(result):
     """Extract PFAM domains from a result in JSON data."""
-    pfam_domains = set()
-    for match in result.get('matches', []):
-        signature = match.get('signature', {})
-        library = signature.get('signatureLibraryRelease', {}).get('library')
-        if library == 'PFAM':
-            pfam_domains.add(signature.get('accession'))
-    return pfam_domains
+    # Bulk frozenset construction over a generator takes the tight C path
+    # instead of per-element SET_ADD bytecode, and the frozenset equality
+    # test against the CSV side short-circuits on the cached hash
+    return frozenset(
+        signature.get('accession')
+        for match in result.get('matches', [])
+        if (signature := match.get('signature', {}))
+           .get('signatureLibraryRelease', {}).get('library') == 'PFAM'
+    )
+
+
+def process_protein(protein, pfam_domains_in_csv, directory):
+    """Filter one protein's FASTA by its expected PFAM domain set.
+
+    Runs in a worker process: progress output is accumulated and returned
+    as a single string so logs from parallel workers don't interleave.
+    """
+    log = []
+
+    # Construct the file paths
+    json_file_path = os.path.join(directory, f'{protein}.json')
+    fasta_file_path = os.path.join(directory, f'{protein}.faa')
+    output_fasta_path = os.path.join(directory, f'{protein}_filtered.faa')
+
+    if not os.path.exists(json_file_path):
+        log.append(f"JSON file not found for {protein}, skipping.")
+        return "\n".join(log)
+
+    if not os.path.exists(fasta_file_path):
+        log.append(f"FASTA file not found for {protein}, skipping.")
+        return "\n".join(log)
+
+    # Read the JSON file; orjson parses InterProScan's dict-and-short-
+    # string heavy output a few times faster when available
+    try:
+        with open(json_file_path, 'rb') as file:
+            raw = file.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:  # covers json and orjson decode errors
+        log.append(f"Error reading JSON file for {protein}: {e}")
+        return "\n".join(log)
+
+    # Extract PFAM predictions and filter based on domains of interest
+    matching_ids = set()
+    for result in data.get('results', []):
+        sequence_id = result.get('xref', [{}])[0].get('id')
+        if not sequence_id:
+            log.append(f"Skipping result without a sequence ID for {protein}.")
+            continue
+
+        # Extract PFAM domains from the JSON result
+        sequence_pfam_domains = extract_pfam_domains(result)
+
+        # Log the PFAM domains found for the sequence
+        log.append(f"Domains found for {sequence_id}: {sequence_pfam_domains}")
+
+        # Check if this sequence matches the protein based on PFAM domains
+        if sequence_pfam_domains == pfam_domains_in_csv:
+            matching_ids.add(sequence_id)
+        else:
+            log.append(
+                f"Domains for {sequence_id} do not match CSV for {protein}. Expected: {pfam_domains_in_csv}, Found: {sequence_pfam_domains}")
+
+    # Log the number of sequences matching the PFAM domains
+    log.append(f"{len(matching_ids)} sequences found for protein {protein}")
+
+    # Read the input FASTA file and write the filtered sequences to the
+    # corresponding output FASTA file. This is a pure filter, so copy the
+    # title and sequence text directly instead of round-tripping through
+    # SeqRecord construction and SeqIO's line rewrapping
+    n_records = 0
+    try:
+        with open(fasta_file_path) as input_handle, \
+                open(output_fasta_path, 'w') as output_handle:
+            for title, sequence in SimpleFastaParser(input_handle):
+                n_records += 1
+                fasta_id = title.split(None, 1)[0]  # Handle potential additional descriptions
+                if fasta_id in matching_ids:
+                    output_handle.write(f">{title}\n{sequence}\n")
+                else:
+                    log.append(f"Skipping {fasta_id} as it doesn't match any sequence ID for {protein}")
+        # The old per-id diagnostic dump re-parsed the whole FASTA just
+        # to print every id; a count from the filter pass covers it
+        log.append(f"{n_records} sequences in {fasta_file_path}")
+        log.append(f"Filtered sequences written for {protein} to {output_fasta_path}")
+    except Exception as e:
+        log.append(f"Error processing FASTA file for {protein}: {e}")
+
+    return "\n".join(log)
 
 
 def main(directory, csv_filename):
@@ -30,77 +119,22 @@ def main(directory, csv_filename):
         reader = csv.reader(csvfile)
         for row in reader:
             protein_name = row[0]
-            pfam_domains = set(row[1:])
+            # Frozen once here; every per-sequence comparison is then a
+            # hash-first set equality instead of rebuilding sets
+            pfam_domains = frozenset(domain for domain in row[1:] if domain)
             if pfam_domains:
                 protein_pfam_dict[protein_name] = pfam_domains
             else:
                 print(f"No PFAM domains found for {protein_name} in the CSV file.")
 
-    # Prepare a dictionary to store sequence IDs for each protein based on PFAM domains
-    protein_sequence_ids = {protein: set() for protein in protein_pfam_dict}
-
-    # Process each protein
-    for protein, pfam_domains_in_csv in protein_pfam_dict.items():
-        # Construct the file paths
-        json_file_path = os.path.join(directory, f'{protein}.json')
-        fasta_file_path = os.path.join(directory, f'{protein}.faa')
-        output_fasta_path = os.path.join(directory, f'{protein}_filtered.faa')
-
-        if not os.path.exists(json_file_path):
-            print(f"JSON file not found for {protein}, skipping.")
-            continue
-
-        if not os.path.exists(fasta_file_path):
-            print(f"FASTA file not found for {protein}, skipping.")
-            continue
-
-        # Read the JSON file
-        try:
-            with open(json_file_path, 'r') as file:
-                data = json.load(file)
-        except json.JSONDecodeError as e:
-            print(f"Error reading JSON file for {protein}: {e}")
-            continue
-
-        # Extract PFAM predictions and filter based on domains of interest
-        for result in data.get('results', []):
-            sequence_id = result.get('xref', [{}])[0].get('id')
-            if not sequence_id:
-                print(f"Skipping result without a sequence ID for {protein}.")
-                continue
-
-            # Extract PFAM domains from the JSON result
-            sequence_pfam_domains = extract_pfam_domains(result)
-
-            # Log the PFAM domains found for the sequence
-            print(f"Domains found for {sequence_id}: {sequence_pfam_domains}")
-
-            # Check if this sequence matches the protein based on PFAM domains
-            if sequence_pfam_domains == pfam_domains_in_csv:
-                protein_sequence_ids[protein].add(sequence_id)
-            else:
-                print(
-                    f"Domains for {sequence_id} do not match CSV for {protein}. Expected: {pfam_domains_in_csv}, Found: {sequence_pfam_domains}")
-
-        # Log the number of sequences matching the PFAM domains
-        print(f"{len(protein_sequence_ids[protein])} sequences found for protein {protein}")
-
-        # Log FASTA IDs
-        fasta_ids = [record.id.split()[0] for record in SeqIO.parse(fasta_file_path, 'fasta')]
-        print(f"Sequence IDs in {fasta_file_path}: {fasta_ids}")
-
-        # Read the input FASTA file and write the filtered sequences to the corresponding output FASTA file
-        try:
-            with open(output_fasta_path, 'w') as output_handle:
-                for record in SeqIO.parse(fasta_file_path, 'fasta'):
-                    fasta_id = record.id.split()[0]  # Handle potential additional descriptions
-                    if fasta_id in protein_sequence_ids[protein]:
-                        SeqIO.write(record, output_handle, 'fasta')
-                    else:
-                        print(f"Skipping {record.id} as it doesn't match any sequence ID for {protein}")
-            print(f"Filtered sequences written for {protein} to {output_fasta_path}")
-        except Exception as e:
-            print(f"Error processing FASTA file for {protein}: {e}")
+    # Each protein reads its own JSON and FASTA and writes its own output,
+    # so the per-protein work is embarrassingly parallel
+    with ProcessPoolExecutor() as executor:
+        for message in executor.map(process_protein,
+                                    protein_pfam_dict.keys(),
+                                    protein_pfam_dict.values(),
+                                    repeat(directory)):
+            print(message)
 
     print("Filtered sequences written to the output directory.")
 
@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -16,20 +19,27 @@ def load_species_order(species_file):
         return [line.strip() for line in f if line.strip()]
 
 
-def main(input_csv, species_file, output_pdf):
-    # Load the presence/absence table
-    df = pd.read_csv(input_csv, index_col=0)
+def main(input_csv, species_file, output_pdf, show=False):
+    # Load the presence/absence table; the cells are 0/1 so parse them
+    # straight into int8 (no dtype-inference pass, ~8x less memory than the
+    # inferred int64, and seaborn takes int8 fine). The species column from
+    # presence_absence.py has an empty header, which pandas names
+    # 'Unnamed: 0' - keep it as strings
+    dtypes = defaultdict(lambda: np.int8, {'Unnamed: 0': object})
+    try:
+        df = pd.read_csv(input_csv, index_col=0, engine='c', dtype=dtypes)
+    except ValueError:
+        # CSVs with a named species column don't fit the dtype map above;
+        # fall back to plain inference for those
+        df = pd.read_csv(input_csv, index_col=0)
 
     # Load the desired order of species (rows)
     species_order = load_species_order(species_file)
 
-    # Ensure all specified species are in the dataframe
-    for species in species_order:
-        if species not in df.index:
-            df.loc[species] = 0
-
-    # Reorder the dataframe according to the specified order
-    df = df.reindex(species_order)
+    # Reorder to the specified species order, adding any missing species as
+    # all-zero rows in the same hash-based pass (the old per-species
+    # membership check and df.loc append copied the frame once per miss)
+    df = df.reindex(species_order, fill_value=0)
 
     # Plot the heatmap
     plt.figure(figsize=(10, 15))  # Adjust figure size as needed
@@ -45,8 +55,11 @@ def main(input_csv, species_file, output_pdf):
     plt.savefig(output_pdf, format='pdf')
     print(f"Heatmap saved as '{output_pdf}'.")
 
-    # Show the plot
-    plt.show()
+    # Show the plot only when explicitly requested, so batch/headless runs
+    # return as soon as the PDF is written; close frees the figure either way
+    if show:
+        plt.show()
+    plt.close()
 
 
 if __name__ == "__main__":
@@ -55,7 +68,8 @@ if __name__ == "__main__":
     parser.add_argument('species_file', type=str,
                         help='File containing the desired species order (one species per line).')
     parser.add_argument('output_pdf', type=str, help='Output path for the heatmap PDF file.')
+    parser.add_argument('--show', action='store_true', help='Display the heatmap interactively after saving.')
 
     args = parser.parse_args()
 
-    main(args.input_csv, args.species_file, args.output_pdf)
\ No newline at end of file
+    main(args.input_csv, args.species_file, args.output_pdf, args.show)
\ No newline at end of file
@@ -1,12 +1,28 @@
 # --- Combined Script: Gene Presence/Absence CSV Creation and Heatmap Generation ---
 
 import os
+import re
+import numpy as np
 import pandas as pd
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 import seaborn as sns
 import matplotlib.pyplot as plt
 import argparse
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the plain-Python kernel works without it
+    njit = None
+
+def _fill_presence(matrix, species_idx, gene_idx):
+    for k in range(species_idx.size):
+        matrix[species_idx[k], gene_idx[k]] = 1
+
+if njit is not None:
+    # LLVM-compile the fill loop; trivial per element, so the win shows up
+    # on runs with hundreds of thousands of FASTA records
+    _fill_presence = njit(cache=True)(_fill_presence)
+
 # Usage:
 # python combined_script.py --fasta_dir path/to/fasta_directory --gene_order_file path/to/gene_order.txt --species_file path/to/species_order.txt --output_csv path/to/output_file.csv --output_pdf path/to/output.pdf
 #
@@ -17,6 +33,13 @@ import argparse
 #   --output_csv: Output CSV file for gene presence/absence data
 #   --output_pdf: Output PDF file for heatmap
 
+# Species-id parsing without building a parts list per record: the rubra
+# headers keep everything from the third field on, everything else keeps
+# all fields after the first
+_RUBRA_RE = re.compile(r'^(?:[^_]*_){4}rubra(?:_|$)')
+_ONE_FIELD_RE = re.compile(r'^[^_]*_')
+_TWO_FIELDS_RE = re.compile(r'^[^_]*_[^_]*_')
+
 def load_desired_gene_order(gene_order_file):
     """Load desired gene order from a file."""
     with open(gene_order_file, 'r') as f:
@@ -30,30 +53,49 @@ def load_species_order(species_file):
 def create_presence_absence_csv(fasta_dir, gene_order_file, output_csv):
     """Process gene FASTA files and create a gene presence/absence CSV."""
     desired_gene_order = load_desired_gene_order(gene_order_file)
-    data = {}
-    for filename in os.listdir(fasta_dir):
-        if filename.endswith('.fasta') or filename.endswith('.faa'):
-            gene_name = os.path.splitext(filename)[0]
+
+    # Integer-encode species and genes while scanning, collect the hit
+    # coordinates as parallel arrays, and fill a preallocated int8 matrix in
+    # one kernel - no dict-of-dicts and no dense fillna pass afterwards
+    species_ids = {}
+    gene_ids = {}
+    species_hits = []
+    gene_hits = []
+
+    # scandir hands back DirEntry objects with cached type info, so there is
+    # no extra stat per entry and no path join until a file qualifies
+    for entry in os.scandir(fasta_dir):
+        if entry.is_file() and entry.name.endswith(('.fasta', '.faa')):
+            gene_name = os.path.splitext(entry.name)[0]
             print(f"Processing gene: {gene_name}")
-            fasta_path = os.path.join(fasta_dir, filename)
-            for record in SeqIO.parse(fasta_path, "fasta"):
-                try:
-                    parts = record.id.split('_')
-                    if len(parts) > 4 and parts[4] == "rubra":
-                        species_id = "_".join(parts[2:])
-                    elif len(parts) > 1:
-                        species_id = "_".join(parts[1:])
+            fasta_path = entry.path
+            # Only the header line is needed, so skip building SeqRecord/Seq
+            # objects for every sequence
+            with open(fasta_path) as fasta_handle:
+                for title, _seq in SimpleFastaParser(fasta_handle):
+                    # A bare '>' line yields an empty title; an empty id
+                    # falls into the "Unexpected format" branch below
+                    # instead of raising IndexError and killing the scan
+                    tokens = title.split(None, 1)
+                    record_id = tokens[0] if tokens else ''
+                    if _RUBRA_RE.match(record_id):
+                        species_id = _TWO_FIELDS_RE.sub('', record_id, count=1)
+                    elif '_' in record_id:
+                        species_id = _ONE_FIELD_RE.sub('', record_id, count=1)  # Drop the first field
                     else:
-                        print(f"Unexpected format in record ID: {record.id}")
+                        print(f"Unexpected format in record ID: {record_id}")
                         continue
                     print(f"Identified species: {species_id} for gene: {gene_name}")
-                    if species_id not in data:
-                        data[species_id] = {}
-                    data[species_id][gene_name] = 1
-                except IndexError:
-                    print(f"Error parsing species ID from record ID: {record.id}")
-                    continue
-    df = pd.DataFrame.from_dict(data, orient='index').fillna(0).astype(int)
+                    species_hits.append(species_ids.setdefault(species_id, len(species_ids)))
+                    gene_hits.append(gene_ids.setdefault(gene_name, len(gene_ids)))
+
+    matrix = np.zeros((len(species_ids), len(gene_ids)), dtype=np.int8)
+    if species_hits:
+        _fill_presence(matrix,
+                       np.array(species_hits, dtype=np.int64),
+                       np.array(gene_hits, dtype=np.int64))
+
+    df = pd.DataFrame(matrix, index=list(species_ids), columns=list(gene_ids))
     for gene in desired_gene_order:
         if gene not in df.columns:
             df[gene] = 0
@@ -62,14 +104,12 @@ def create_presence_absence_csv(fasta_dir, gene_order_file, output_csv):
     print(f"CSV file '{output_csv}' has been created.")
     return df
 
-def plot_heatmap(input_csv, species_file, output_pdf):
+def plot_heatmap(input_csv, species_file, output_pdf, show=False):
     """Generate a heatmap of gene presence/absence data."""
     df = pd.read_csv(input_csv, index_col=0)
     species_order = load_species_order(species_file)
-    for species in species_order:
-        if species not in df.index:
-            df.loc[species] = 0
-    df = df.reindex(species_order)
+    # One reindex adds missing species as zero rows and applies the ordering
+    df = df.reindex(species_order, fill_value=0)
     plt.figure(figsize=(10, 15))
     heatmap = sns.heatmap(df, cmap="YlGnBu", linewidths=0.5, linecolor='gray', cbar_kws={"shrink": .5})
     heatmap.set_yticklabels(heatmap.get_yticklabels(), rotation=0, fontsize=8)
@@ -77,7 +117,10 @@ def plot_heatmap(input_csv, species_file, output_pdf):
     plt.tight_layout()
     plt.savefig(output_pdf, format='pdf')
     print(f"Heatmap saved as '{output_pdf}'.")
-    plt.show()
+    # Show only on request so batch runs return right after the save
+    if show:
+        plt.show()
+    plt.close()
     return df
 
 def main():
@@ -87,6 +130,7 @@ def main():
     parser.add_argument('--species_file', type=str, required=True, help='File with desired species order.')
     parser.add_argument('--output_csv', type=str, required=True, help='Output CSV file.')
     parser.add_argument('--output_pdf', type=str, required=True, help='Output PDF file for heatmap.')
+    parser.add_argument('--show', action='store_true', help='Display the heatmap interactively after saving.')
     args = parser.parse_args()
 
     # Step 1: Create presence/absence CSV
@@ -95,7 +139,7 @@ def main():
     print(df_csv)
 
     # Step 2: Generate heatmap
-    df_heatmap = plot_heatmap(args.output_csv, args.species_file, args.output_pdf)
+    df_heatmap = plot_heatmap(args.output_csv, args.species_file, args.output_pdf, args.show)
     print("\nHeatmap DataFrame (after species reordering):")
     print(df_heatmap)
 
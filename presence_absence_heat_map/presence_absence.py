@@ -1,6 +1,8 @@
 import os
+import re
+import numpy as np
 import pandas as pd
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 import argparse
 
 # Use: python presence_absence.py path/to/fasta_directory path/to/gene_order.txt path/to/output_file.csv
@@ -9,6 +11,14 @@ import argparse
 # Gene Order File: Create a text file named gene_order.txt. Each line should contain one gene that you want in the
 # specified order.
 
+# Species-id parsing without building a parts list per record: the rubra
+# headers keep everything from the third field on, everything else keeps
+# all fields after the first
+_RUBRA_RE = re.compile(r'^(?:[^_]*_){4}rubra(?:_|$)')
+_ONE_FIELD_RE = re.compile(r'^[^_]*_')
+_TWO_FIELDS_RE = re.compile(r'^[^_]*_[^_]*_')
+
+
 def load_desired_gene_order(gene_order_file):
     """Load desired gene order from a file."""
     with open(gene_order_file, 'r') as f:
@@ -19,48 +29,56 @@ def main(fasta_dir, gene_order_file, output_csv):
     # Load the desired gene order from the specified file
     desired_gene_order = load_desired_gene_order(gene_order_file)
 
-    # Initialize an empty dictionary to store the presence/absence data
-    data = {}
+    # Collect the (species, gene) hits as two parallel lists; crosstab
+    # densifies them in one vectorized pass at the end
+    species_hits = []
+    gene_hits = []
 
     # Loop over each FASTA file in the directory
-    for filename in os.listdir(fasta_dir):
-        if filename.endswith('.fasta') or filename.endswith('.faa'):
-            gene_name = os.path.splitext(filename)[0]
+    # scandir hands back DirEntry objects with cached type info, so there is
+    # no extra stat per entry and no path join until a file qualifies
+    for entry in os.scandir(fasta_dir):
+        if entry.is_file() and entry.name.endswith(('.fasta', '.faa')):
+            gene_name = os.path.splitext(entry.name)[0]
             print(f"Processing gene: {gene_name}")
 
             # Parse the FASTA file
-            fasta_path = os.path.join(fasta_dir, filename)
-            for record in SeqIO.parse(fasta_path, "fasta"):
-                try:
-                    parts = record.id.split('_')
-                    if len(parts) > 4 and parts[4] == "rubra":
-                        species_id = "_".join(parts[2:])
-                    elif len(parts) > 1:
-                        species_id = "_".join(parts[1:])  # Join all parts after the first one
+            fasta_path = entry.path
+            # Only the header line is needed, so skip building SeqRecord/Seq
+            # objects for every sequence
+            with open(fasta_path) as fasta_handle:
+                for title, _seq in SimpleFastaParser(fasta_handle):
+                    # A bare '>' line yields an empty title; an empty id
+                    # falls into the "Unexpected format" branch below
+                    # instead of raising IndexError and killing the scan
+                    tokens = title.split(None, 1)
+                    record_id = tokens[0] if tokens else ''
+                    if _RUBRA_RE.match(record_id):
+                        species_id = _TWO_FIELDS_RE.sub('', record_id, count=1)
+                    elif '_' in record_id:
+                        species_id = _ONE_FIELD_RE.sub('', record_id, count=1)  # Drop the first field
                     else:
-                        print(f"Unexpected format in record ID: {record.id}")
+                        print(f"Unexpected format in record ID: {record_id}")
                         continue
                     print(f"Identified species: {species_id} for gene: {gene_name}")
 
-                    if species_id not in data:
-                        data[species_id] = {}
-                    data[species_id][gene_name] = 1  # Mark gene as present
-
-                except IndexError:
-                    print(f"Error parsing species ID from record ID: {record.id}")
-                    continue
-
-    # Convert the data dictionary to a DataFrame
-    df = pd.DataFrame.from_dict(data, orient='index').fillna(0).astype(int)
-
-    # Reorder the columns based on the desired gene order
-    # Ensure all desired genes are included, even if they don't appear in the data
-    for gene in desired_gene_order:
-        if gene not in df.columns:
-            df[gene] = 0  # Add missing genes as columns with 0s
-
-    # Reorder the columns
-    df = df[desired_gene_order]
+                    species_hits.append(species_id)
+                    gene_hits.append(gene_name)  # Mark gene as present
+
+    # One C-level crosstab replaces the dict-of-dicts plus fillna pass.
+    # Categorical genes pin the columns to the desired order: genes outside
+    # the list are masked to NaN (and so drop out) and missing ones appear
+    # as all-zero columns
+    desired_genes = set(desired_gene_order)
+    genes = pd.Categorical([gene if gene in desired_genes else None for gene in gene_hits],
+                           categories=desired_gene_order)
+    df = pd.crosstab(pd.Index(species_hits), genes,
+                     dropna=False).clip(upper=1).astype(np.int8)
+    # Restore first-seen species order and keep species whose only hits were
+    # genes outside the desired list (crosstab drops those rows)
+    df = df.reindex(pd.unique(pd.Series(species_hits)), fill_value=0)
+    df.index.name = None
+    df.columns.name = None
 
     # Save the DataFrame to a CSV file
     df.to_csv(output_csv)
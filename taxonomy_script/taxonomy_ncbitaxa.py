@@ -10,28 +10,58 @@ import argparse
 # BLASTP Results File: Create a text file named blastp.txt. Each line should contain a unique identifier in the
 # format assembly_accession-unique_id.
 
-# Function to get taxonomy lineage
-def get_taxonomy_lineage(ncbi, taxid):
-    try:
-        lineage = ncbi.get_lineage(taxid)
-        names = ncbi.get_taxid_translator(lineage)
-        ranks = ncbi.get_rank(lineage)
-        rank_names = {rank: names[taxid] for taxid, rank in ranks.items()}
-        rank_order = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
-        return [rank_names.get(rank, '') for rank in rank_order]
-    except Exception as e:
-        logging.error(f"Error retrieving taxonomy for taxid {taxid}: {e}")
-        return ['NA'] * 7  # Return empty ranks if there's an issue
-
-
-def main(assembly_accession_taxid, blastp_result, output_file_path):
+# Function to get taxonomy lineages for a batch of taxids
+def get_taxonomy_lineages(ncbi, taxids):
+    """Resolve ranks for all taxids with three batched NCBITaxa queries.
+
+    Each per-taxid call used to issue three SQLite round trips; here the
+    lineages are fetched per unique taxid and the name/rank translators run
+    once over the union of all lineage ids. Returns a dict mapping taxid to
+    the seven-rank list (['NA'] * 7 when lookup failed).
+    """
+    rank_order = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+    lineages = {}
+    for taxid in taxids:
+        try:
+            lineages[taxid] = ncbi.get_lineage(taxid)
+        except Exception as e:
+            logging.error(f"Error retrieving taxonomy for taxid {taxid}: {e}")
+            lineages[taxid] = None
+
+    # One translator/rank query over every lineage id seen (skipped when
+    # every lookup failed - ete3 chokes on an empty id list)
+    all_lineage_ids = set()
+    for lineage in lineages.values():
+        if lineage:
+            all_lineage_ids.update(lineage)
+    names = ncbi.get_taxid_translator(list(all_lineage_ids)) if all_lineage_ids else {}
+    ranks = ncbi.get_rank(list(all_lineage_ids)) if all_lineage_ids else {}
+
+    taxonomy_by_taxid = {}
+    for taxid, lineage in lineages.items():
+        if not lineage:
+            taxonomy_by_taxid[taxid] = ['NA'] * 7  # Return empty ranks if there's an issue
+            continue
+        rank_names = {ranks[lineage_id]: names[lineage_id]
+                      for lineage_id in lineage
+                      if lineage_id in ranks and lineage_id in names}
+        taxonomy_by_taxid[taxid] = [rank_names.get(rank, '') for rank in rank_order]
+
+    return taxonomy_by_taxid
+
+
+def main(assembly_accession_taxid, blastp_result, output_file_path, update_taxonomy=False):
     # Define error output path and log file path
     error_file_path = 'custom_refseq_error_taxonomy.tsv'
     log_file_path = 'assembly_taxonomy_log.txt'
 
-    # Initialize NCBITaxa
+    # Initialize NCBITaxa. Rebuilding the local taxonomy database downloads
+    # the NCBI dump and takes minutes, so it only runs when asked for;
+    # routine runs reuse the cached database
     ncbi = NCBITaxa()
-    ncbi.update_taxonomy_database()
+    if update_taxonomy:
+        ncbi.update_taxonomy_database()
 
     # Configure logging
     logging.basicConfig(filename=log_file_path, level=logging.ERROR, format='%(asctime)s %(message)s')
@@ -43,20 +73,30 @@ def main(assembly_accession_taxid, blastp_result, output_file_path):
     with open(blastp_result, 'r') as f:
         unique_ids = f.read().splitlines()
 
-    # Parse the BLAST results
-    parsed_data = [line.split('-') for line in unique_ids]
-    parsed_df = pd.DataFrame(parsed_data, columns=['assembly_accession', 'unique_id'])
-    parsed_df['full_id'] = parsed_df['assembly_accession'] + '-' + parsed_df['unique_id']
+    # Parse the BLAST results with pandas' vectorized string ops instead of
+    # a Python-level split per line; the lines already are the full ids.
+    # expand on an empty Series yields zero columns, so build the empty
+    # two-column frame explicitly for a blank results file
+    ids = pd.Series(unique_ids, dtype=str)
+    if ids.empty:
+        parsed_df = pd.DataFrame(columns=[0, 1], dtype=str)
+    else:
+        parsed_df = ids.str.split('-', n=1, expand=True)
+    parsed_df.columns = ['assembly_accession', 'unique_id']
+    parsed_df['full_id'] = ids
 
     # Initialize lists for results and errors
     taxonomy_results = []
     error_entries = []
 
-    # Process each row to get taxonomy information
+    # Resolve every unique taxid in one batch (many assemblies share one),
+    # then assemble the per-assembly rows from the cached results
+    taxonomy_by_taxid = get_taxonomy_lineages(ncbi, df['taxid'].unique())
+
     for _, row in df.iterrows():
         taxid = row['taxid']
         assembly_accession = row['assembly_accession']
-        taxonomy = get_taxonomy_lineage(ncbi, taxid)
+        taxonomy = taxonomy_by_taxid[taxid]
         if taxonomy == ['NA'] * 7:
             error_entries.append([assembly_accession, taxid])
         taxonomy_results.append([assembly_accession] + taxonomy)
@@ -66,8 +106,18 @@ def main(assembly_accession_taxid, blastp_result, output_file_path):
     taxonomy_df = pd.DataFrame(taxonomy_results, columns=taxonomy_columns)
     error_df = pd.DataFrame(error_entries, columns=['assembly_accession', 'taxid'])
 
-    # Merge the parsed data with the taxonomy information
-    merged_df = parsed_df.merge(taxonomy_df, on='assembly_accession', how='left')
+    # Merge the parsed data with the taxonomy information. With many BLAST
+    # hits per assembly the merge cost is dominated by hashing the repeated
+    # accession strings, so give both sides one shared categorical dtype and
+    # let the join hash integer codes instead
+    common_accessions = pd.api.types.union_categoricals(
+        [pd.Categorical(parsed_df['assembly_accession']),
+         pd.Categorical(taxonomy_df['assembly_accession'])]).categories
+    parsed_df['assembly_accession'] = pd.Categorical(parsed_df['assembly_accession'],
+                                                     categories=common_accessions)
+    taxonomy_df['assembly_accession'] = pd.Categorical(taxonomy_df['assembly_accession'],
+                                                       categories=common_accessions)
+    merged_df = parsed_df.merge(taxonomy_df, on='assembly_accession', how='left', sort=False)
 
     # Reorder columns to have 'full_id' first followed by taxonomy columns
     final_columns = ['full_id'] + taxonomy_columns[1:]
@@ -88,7 +138,10 @@ if __name__ == "__main__":
                         help='Path to the TSV file containing assembly accessions and tax IDs.')
     parser.add_argument('blastp_result', type=str, help='Path to the BLASTP results text file.')
     parser.add_argument('output_file_path', type=str, help='Path to the output TSV file for taxonomy results.')
+    parser.add_argument('--update-taxonomy', action='store_true',
+                        help='Download and rebuild the local NCBI taxonomy database before running '
+                             '(slow; needed once, then on demand).')
 
     args = parser.parse_args()
 
-    main(args.assembly_accession_taxid, args.blastp_result, args.output_file_path)
\ No newline at end of file
+    main(args.assembly_accession_taxid, args.blastp_result, args.output_file_path, args.update_taxonomy)
\ No newline at end of file